@@ -1,9 +1,138 @@
-from typing import Dict, List, Tuple, Optional, Set
+from typing import Dict, Iterable, List, Tuple, Optional, Set
 from datetime import datetime
-import uuid
-from decimal import Decimal
+import itertools
+import os
+import time
+from decimal import Decimal, ROUND_HALF_UP
 from enum import Enum
 import json
+import heapq
+
+try:
+    import orjson
+except ImportError:
+    # Optional: C-accelerated JSON; falls back to the standard library
+    orjson = None
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    # Optional: compiled settlement loop for very large groups
+    np = None
+    njit = None
+
+
+# Largest transaction total in cents. Every amount a saved transaction holds is at most
+# its total, so this keeps saved files within the signed 64-bit integers orjson handles
+_MAX_TOTAL_CENTS = 2 ** 63 - 1
+
+
+def _to_cents(amount: Decimal, what: str = "Amount") -> int:
+    # Convert to whole cents (hundredths). Sub-cent precision is rejected
+    # rather than silently rounded
+    scaled = Decimal(amount) * 100
+    if not scaled.is_finite() or scaled != scaled.to_integral_value():
+        raise ValueError(f"{what} {amount} must be a finite number with at most 2 decimal places")
+    return int(scaled)
+
+
+def _round_cents(amount: Decimal) -> int:
+    # Nearest whole cent, halves away from zero. Only used for v1 files, which
+    # could hold sub-cent amounts
+    scaled = Decimal(amount) * 100
+    if not scaled.is_finite():
+        raise ValueError(f"Amount {amount} must be a finite number")
+    return int(scaled.to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _from_cents(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+
+def _allocate_cents(total: int, weights: List[int]) -> List[int]:
+    # Split total proportionally to weights; leftover cents go to the first
+    # weighted entries so the parts always sum exactly to total
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        return [0] * len(weights)
+    parts = [total * weight // weight_sum for weight in weights]
+    remainder = total - sum(parts)
+    for i, weight in enumerate(weights):
+        if remainder <= 0:
+            break
+        if weight > 0:
+            parts[i] += 1
+            remainder -= 1
+    return parts
+
+
+def _equal_shares(total_cents: int, user_ids: List[str]) -> Dict[str, int]:
+    # One divmod; the leftover cents go to the first user_ids
+    if not user_ids:
+        return {}
+    share, remainder = divmod(total_cents, len(user_ids))
+    shares = [share + 1] * remainder + [share] * (len(user_ids) - remainder)
+    return dict(zip(user_ids, shares))
+
+
+def _net_contributions(payers_cents: Dict[str, int], share_map: Dict[str, int]) -> Dict[str, int]:
+    # paid - owed per user, in one pass over payers and one over shares
+    net: Dict[str, int] = {}
+    for user_id, cents in payers_cents.items():
+        net[user_id] = net.get(user_id, 0) + cents
+    for user_id, share in share_map.items():
+        net[user_id] = net.get(user_id, 0) - share
+    return net
+
+
+def _allocate_debts(debts: List[int], credits: List[int]) -> List[List[int]]:
+    # Split each debt across creditors in proportion to their credit. Rounded
+    # down first, then leftover cents are handed out largest-shortfall first so
+    # every row sums to its debt and every column to its credit
+    total = sum(credits)
+    if total <= 0:
+        return [[0] * len(credits) for _ in debts]
+    matrix = [[debt * credit // total for credit in credits] for debt in debts]
+    row_short = [debt - sum(row) for debt, row in zip(debts, matrix)]
+    col_short = [credit - sum(row[j] for row in matrix) for j, credit in enumerate(credits)]
+    for i in sorted(range(len(debts)), key=lambda i: -row_short[i]):
+        columns = sorted(range(len(credits)), key=lambda j: -col_short[j])[:row_short[i]]
+        for j in columns:
+            if col_short[j] <= 0:
+                break
+            matrix[i][j] += 1
+            col_short[j] -= 1
+    return matrix
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _settle_sorted(amounts):
+        # Two-pointer greedy over balances sorted ascending (debtors first).
+        # Returns parallel arrays of (debtor index, creditor index, cents).
+        n = amounts.shape[0]
+        balances = amounts.copy()
+        debtors = np.empty(n, np.int64)
+        creditors = np.empty(n, np.int64)
+        transfers = np.empty(n, np.int64)
+        count = 0
+        i, j = 0, n - 1
+        while i < j:
+            if balances[i] >= 0 or balances[j] <= 0:
+                break
+            amount = min(-balances[i], balances[j])
+            debtors[count] = i
+            creditors[count] = j
+            transfers[count] = amount
+            count += 1
+            balances[i] += amount
+            balances[j] -= amount
+            if balances[i] == 0:
+                i += 1
+            if balances[j] == 0:
+                j -= 1
+        return debtors[:count], creditors[:count], transfers[:count]
 
 
 class SplitType(Enum):
@@ -14,6 +143,8 @@ class SplitType(Enum):
 
 class User:
     
+    __slots__ = ("user_id", "name", "email")
+    
     def __init__(self, user_id: str, name: str, email: str):
         self.user_id = user_id
         self.name = name
@@ -40,6 +171,10 @@ class User:
 
 class Transaction:
 
+    __slots__ = ("transaction_id", "description", "date", "participants", "split_type",
+                 "_payers_cents", "_split_details_cents", "total_cents",
+                 "_participants_set", "_payers_set", "_share_map", "net_contributions")
+
     def __init__(self, 
                  transaction_id: str,
                  description: str,
@@ -49,95 +184,378 @@ class Transaction:
                  split_type: SplitType = SplitType.EQUAL,
                  split_details: Optional[Dict[str, Decimal]] = None):  # For non-equal splits
         
+        # Amounts are held as integer cents; percentages as hundredths of a percent
+        what = "Percentage" if split_type == SplitType.PERCENTAGE else "Amount"
+        self._setup(transaction_id, description, date, participants, split_type,
+                    ((user_id, _to_cents(amount)) for user_id, amount in payers.items()),
+                    ((user_id, _to_cents(value, what)) for user_id, value in (split_details or {}).items()))
+    
+    @classmethod
+    def from_cents(cls,
+                   transaction_id: str,
+                   description: str,
+                   date: datetime,
+                   payers_cents: Dict[str, int],
+                   participants: List[str],
+                   split_type: SplitType = SplitType.EQUAL,
+                   split_details_cents: Optional[Dict[str, int]] = None) -> 'Transaction':
+
+        # Build from amounts already in integer cents, skipping the Decimal round trip
+        transaction = cls.__new__(cls)
+        transaction._setup(transaction_id, description, date, participants, split_type,
+                           payers_cents.items(), (split_details_cents or {}).items())
+        return transaction
+    
+    def _setup(self,
+               transaction_id: str,
+               description: str,
+               date: datetime,
+               participants: List[str],
+               split_type: SplitType,
+               payers_cents: Iterable[Tuple[str, int]],
+               split_details_cents: Iterable[Tuple[str, int]]):
+        
         self.transaction_id = transaction_id
         self.description = description
         self.date = date
-        self.payers = payers
-        self.participants = participants
+        self.participants = list(participants)
         self.split_type = split_type
-        self.split_details = split_details or {}
         
-        # Calculate total amount of transaction
-        self.total_amount = sum(payers.values())
+        # One pass over payers checks each payment is positive and sums the total
+        self._payers_cents: Dict[str, int] = {}
+        total = 0
+        for user_id, cents in payers_cents:
+            # Cents read back from a file are not type-checked by JSON; bool is rejected too
+            if type(cents) is not int:
+                raise ValueError(f"Payment amount for user {user_id} must be integer cents, got {cents!r}")
+            if cents <= 0:
+                raise ValueError(f"Payment amount must be positive for user {user_id}")
+            self._payers_cents[user_id] = cents
+            total += cents
+        if total > _MAX_TOTAL_CENTS:
+            raise ValueError(f"Transaction total {_from_cents(total)} exceeds the maximum of {_from_cents(_MAX_TOTAL_CENTS)}")
+        self.total_cents = total
+        
+        # Likewise one pass over split details
+        self._split_details_cents: Dict[str, int] = {}
+        split_total = 0
+        negative = False
+        for user_id, cents in split_details_cents:
+            if type(cents) is not int:
+                raise ValueError(f"Split detail for user {user_id} must be integer cents, got {cents!r}")
+            self._split_details_cents[user_id] = cents
+            split_total += cents
+            negative = negative or cents < 0
         
         # Validate the transaction
-        self._validate()
+        self._participants_set = frozenset(participants)
+        self._validate(split_total, negative)
         
-    def _validate(self):
-        # Ensure all payers are valid (have positive payment amounts)
-        for user_id, amount in self.payers.items():
-            if amount <= 0:
-                raise ValueError(f"Payment amount must be positive for user {user_id}")
-                
-        # For percentage split, ensure percentages sum to 100
-        if self.split_type == SplitType.PERCENTAGE and self.split_details:
-            total_percentage = sum(self.split_details.values())
-            if abs(total_percentage - Decimal('100')) > Decimal('0.01'):
-                raise ValueError(f"Percentage split must sum to 100%, got {total_percentage}%")
+        # Precompute each participant's share once; the transaction is not mutated after creation
+        self._payers_set = frozenset(self._payers_cents)
+        self._share_map = self._compute_shares()
+        self.net_contributions = self._compute_net_contributions()
+    
+    @property
+    def payers(self) -> Dict[str, Decimal]:
+        return {user_id: _from_cents(cents) for user_id, cents in self._payers_cents.items()}
+    
+    @property
+    def split_details(self) -> Dict[str, Decimal]:
+        return {user_id: _from_cents(value) for user_id, value in self._split_details_cents.items()}
+    
+    @property
+    def total_amount(self) -> Decimal:
+        return _from_cents(self.total_cents)
+        
+    def _validate(self, split_total: int, negative: bool):
+        # Payment amounts are already checked while summing them in __init__.
+        # The checks below guarantee the shares add up to exactly what was paid,
+        # so every transaction's net contributions sum to zero
+        if not self._participants_set:
+            raise ValueError("Transaction must have at least one participant")
+        
+        if self.split_type != SplitType.EQUAL:
+            if not self._split_details_cents:
+                raise ValueError(f"{self.split_type.value.capitalize()} split requires split details")
+            outsiders = self._split_details_cents.keys() - self._participants_set
+            if outsiders:
+                raise ValueError(f"Split details given for non-participants: {', '.join(sorted(outsiders))}")
+            if negative:
+                raise ValueError("Split details must not be negative")
+        
+        # For percentage split, ensure percentages sum to exactly 100 (10000 hundredths)
+        if self.split_type == SplitType.PERCENTAGE:
+            if split_total != 10000:
+                raise ValueError(f"Percentage split must sum to 100%, got {_from_cents(split_total)}%")
                 
-        # For exact split, ensure amounts sum to total
-        if self.split_type == SplitType.EXACT and self.split_details:
-            total_split = sum(self.split_details.values())
-            if abs(total_split - self.total_amount) > Decimal('0.01'):
-                raise ValueError(f"Exact split amounts must sum to {self.total_amount}, got {total_split}")
+        # For exact split, ensure amounts sum to exactly the total
+        if self.split_type == SplitType.EXACT:
+            if split_total != self.total_cents:
+                raise ValueError(f"Exact split amounts must sum to {self.total_amount}, got {_from_cents(split_total)}")
     
-    def get_user_share(self, user_id: str) -> Decimal:
+    def _compute_shares(self) -> Dict[str, int]:
 
-        if user_id not in self.participants:
-            return Decimal('0')
-            
         if self.split_type == SplitType.EQUAL:
-            return self.total_amount / len(self.participants)
+            # Common case: one divmod, with the leftover cents going to the first
+            # participants in sorted order so the result does not depend on input order
+            return _equal_shares(self.total_cents, sorted(self._participants_set))
         elif self.split_type == SplitType.PERCENTAGE:
-            if user_id not in self.split_details:
-                return Decimal('0')
-            return (self.split_details[user_id] / Decimal('100')) * self.total_amount
+            # dict.fromkeys drops repeated participants so each user gets one weight
+            user_ids = [user_id for user_id in dict.fromkeys(self.participants)
+                        if user_id in self._split_details_cents]
+            weights = [self._split_details_cents[user_id] for user_id in user_ids]
+            return dict(zip(user_ids, _allocate_cents(self.total_cents, weights)))
         elif self.split_type == SplitType.EXACT:
-            if user_id not in self.split_details:
-                return Decimal('0')
-            return self.split_details[user_id]
+            return dict(self._split_details_cents)
         
-        return Decimal('0')
+        return {}
+    
+    def get_user_share(self, user_id: str) -> Decimal:
+
+        return _from_cents(self._share_map.get(user_id, 0))
     
     def get_user_payment(self, user_id: str) -> Decimal:
 
-        return self.payers.get(user_id, Decimal('0'))
+        return _from_cents(self._payers_cents.get(user_id, 0))
     
     def get_user_balance(self, user_id: str) -> Decimal:
 
-        paid = self.get_user_payment(user_id)
-        owed = self.get_user_share(user_id)
-        return paid - owed
+        return _from_cents(self.net_contributions.get(user_id, 0))
+    
+    def _compute_net_contributions(self) -> Dict[str, int]:
+
+        # Net position in cents of each involved user in this transaction (paid - owed)
+        return _net_contributions(self._payers_cents, self._share_map)
     
     def to_dict(self) -> Dict:
 
+        # Schema v2 stores amounts as integer cents (percentages as hundredths of a percent)
         return {
+            "v": 2,
             "transaction_id": self.transaction_id,
             "description": self.description,
             "date": self.date.isoformat(),
-            "payers": {k: str(v) for k, v in self.payers.items()},
-            "participants": self.participants,
+            "payers_cents": dict(self._payers_cents),
+            "participants": list(self.participants),
             "split_type": self.split_type.value,
-            "split_details": {k: str(v) for k, v in self.split_details.items()} if self.split_details else {},
-            "total_amount": str(self.total_amount)
+            "split_details_cents": dict(self._split_details_cents),
+            "total_cents": self.total_cents
         }
     
     @classmethod
     def from_dict(cls, data: Dict) -> 'Transaction':
 
-        return cls(
+        try:
+            if data.get("v", 1) < 2:
+                return cls._from_v1_dict(data)
+            
+            # v2 amounts are already integer cents
+            return cls.from_cents(
+                transaction_id=data["transaction_id"],
+                description=data["description"],
+                date=datetime.fromisoformat(data["date"]),
+                payers_cents=data["payers_cents"],
+                participants=data["participants"],
+                split_type=SplitType(data["split_type"]),
+                split_details_cents=data["split_details_cents"]
+            )
+        except ValueError as e:
+            raise ValueError(f"Transaction {data.get('transaction_id')}: {e}") from e
+    
+    @classmethod
+    def _from_v1_dict(cls, data: Dict) -> 'Transaction':
+
+        # v1 files store amounts as decimal strings and were written under looser
+        # checks: sub-cent amounts, splits within 0.01 of their target, missing split
+        # details and details for non-participants were all accepted. Normalise them
+        # rather than reject the file: round to cents, drop details for non-participants,
+        # treat a split without details as equal, and put any difference left by rounding
+        # on the first detailed participant in sorted user ID order
+        participants = data["participants"]
+        split_type = SplitType(data["split_type"])
+        payers_cents = {}
+        for user_id, amount in data["payers"].items():
+            cents = _round_cents(Decimal(amount))
+            if cents:
+                payers_cents[user_id] = cents
+        
+        members = set(participants)
+        split_details_cents = {user_id: _round_cents(Decimal(value))
+                               for user_id, value in (data["split_details"] or {}).items() if user_id in members}
+        if split_type != SplitType.EQUAL:
+            if not split_details_cents:
+                split_type = SplitType.EQUAL
+            else:
+                target = 10000 if split_type == SplitType.PERCENTAGE else sum(payers_cents.values())
+                residual = target - sum(split_details_cents.values())
+                if residual:
+                    split_details_cents[min(split_details_cents)] += residual
+        
+        return cls.from_cents(
             transaction_id=data["transaction_id"],
             description=data["description"],
             date=datetime.fromisoformat(data["date"]),
-            payers={k: Decimal(v) for k, v in data["payers"].items()},
-            participants=data["participants"],
-            split_type=SplitType(data["split_type"]),
-            split_details={k: Decimal(v) for k, v in data["split_details"].items()} if data["split_details"] else None
+            payers_cents=payers_cents,
+            participants=participants,
+            split_type=split_type,
+            split_details_cents=split_details_cents
         )
 
 
+class DebtGraph:
+
+    # Pairwise debts in cents, kept free of circular debts (A owes B owes C owes A).
+    # owes[debtor][creditor] is what debtor owes creditor and owed_by mirrors it, so a
+    # user's creditors and debtors are each one lookup. order is a topological order:
+    # every debt runs from a lower position to a higher one
+    __slots__ = ("owes", "owed_by", "order", "_positions")
+    
+    def __init__(self):
+        self.owes: Dict[str, Dict[str, int]] = {}
+        self.owed_by: Dict[str, Dict[str, int]] = {}
+        self.order: Dict[str, int] = {}
+        self._positions = itertools.count()
+    
+    def add(self, debtor_id: str, creditor_id: str, cents: int):
+
+        # Anything the creditor already owes the debtor is netted off first
+        reverse = self.owes.get(creditor_id, {}).get(debtor_id, 0)
+        if reverse:
+            offset = min(reverse, cents)
+            self._adjust(creditor_id, debtor_id, -offset)
+            cents -= offset
+            if not cents:
+                return
+        self._adjust(debtor_id, creditor_id, cents)
+        
+        # A debt that runs forward in the order cannot close a cycle
+        upper = self.order[debtor_id]
+        lower = self.order[creditor_id]
+        if lower > upper:
+            return
+        
+        # Otherwise any new cycle runs through debtor -> creditor. Each one found is
+        # cancelled by subtracting its smallest debt, which pays and receives the same
+        # amount at every user on it and so leaves net positions unchanged
+        forward: Set[str] = set()
+        while creditor_id in self.owes.get(debtor_id, {}):
+            path = self._find_path(creditor_id, debtor_id, upper, forward)
+            if path is None:
+                self._reorder(debtor_id, lower, forward)
+                return
+            edges = list(zip(path, path[1:])) + [(debtor_id, creditor_id)]
+            amount = min(self.owes[from_id][to_id] for from_id, to_id in edges)
+            for from_id, to_id in edges:
+                self._adjust(from_id, to_id, -amount)
+    
+    def _adjust(self, debtor_id: str, creditor_id: str, delta: int):
+
+        # Change one debt and its mirror in owed_by; debts that reach zero are dropped.
+        # Users new to the graph are placed at the end of the order
+        row = self.owes.setdefault(debtor_id, {})
+        cents = row.get(creditor_id, 0) + delta
+        if cents:
+            row[creditor_id] = cents
+            self.owed_by.setdefault(creditor_id, {})[debtor_id] = cents
+            for user_id in (debtor_id, creditor_id):
+                if user_id not in self.order:
+                    self.order[user_id] = next(self._positions)
+            return
+        del row[creditor_id]
+        if not row:
+            del self.owes[debtor_id]
+        column = self.owed_by[creditor_id]
+        del column[debtor_id]
+        if not column:
+            del self.owed_by[creditor_id]
+    
+    def _find_path(self, source: str, target: str, upper: int, dead: Set[str]) -> Optional[List[str]]:
+
+        # Depth-first search for source -> ... -> target through users ordered before
+        # target. Users found not to reach target are added to dead, which stays true
+        # while cycles are cancelled because debts are only reduced
+        path = [source]
+        work = [iter(self.owes.get(source, {}))]
+        while work:
+            for neighbour in work[-1]:
+                if neighbour == target:
+                    path.append(target)
+                    return path
+                if neighbour not in dead and self.order[neighbour] < upper:
+                    path.append(neighbour)
+                    work.append(iter(self.owes.get(neighbour, {})))
+                    break
+            else:
+                dead.add(path.pop())
+                work.pop()
+        return None
+    
+    def _reorder(self, debtor_id: str, lower: int, forward: Set[str]):
+
+        # The new debt runs backwards in the order and closed no cycle. forward holds
+        # the creditor and what it reaches before the debtor's position; collect the
+        # debtor and those owing it after the creditor's position, then hand the
+        # debtor's side the lowest of their positions and the creditor's side the rest
+        backward = {debtor_id}
+        stack = [debtor_id]
+        while stack:
+            for other_id in self.owed_by.get(stack.pop(), {}):
+                if other_id not in backward and self.order[other_id] > lower:
+                    backward.add(other_id)
+                    stack.append(other_id)
+        users = sorted(backward, key=self.order.__getitem__) + sorted(forward, key=self.order.__getitem__)
+        positions = sorted(self.order[user_id] for user_id in users)
+        for user_id, position in zip(users, positions):
+            self.order[user_id] = position
+    
+    def net_positions(self) -> Dict[str, int]:
+
+        net: Dict[str, int] = {}
+        for debtor_id, row in self.owes.items():
+            for creditor_id, cents in row.items():
+                net[debtor_id] = net.get(debtor_id, 0) - cents
+                net[creditor_id] = net.get(creditor_id, 0) + cents
+        return {user_id: cents for user_id, cents in net.items() if cents}
+    
+    def to_dict(self) -> Dict[str, Dict[str, int]]:
+
+        return {debtor_id: dict(row) for debtor_id, row in self.owes.items()}
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Dict[str, int]]) -> Optional['DebtGraph']:
+
+        # Returns None for saved debts that are malformed or circular
+        graph = cls()
+        for debtor_id, row in data.items():
+            for creditor_id, cents in row.items():
+                if type(cents) is not int or cents <= 0 or debtor_id == creditor_id:
+                    return None
+                graph.owes.setdefault(debtor_id, {})[creditor_id] = cents
+                graph.owed_by.setdefault(creditor_id, {})[debtor_id] = cents
+        
+        # Kahn's algorithm gives the order, and reaches every user only if there are no cycles
+        indegree = {user_id: len(column) for user_id, column in graph.owed_by.items()}
+        ready = [user_id for user_id in graph.owes if user_id not in indegree]
+        while ready:
+            user_id = ready.pop()
+            graph.order[user_id] = next(graph._positions)
+            for creditor_id in graph.owes.get(user_id, {}):
+                indegree[creditor_id] -= 1
+                if not indegree[creditor_id]:
+                    ready.append(creditor_id)
+        if len(graph.order) != len(graph.owes.keys() | graph.owed_by.keys()):
+            return None
+        return graph
+
+
 class ExpenseManager:
 
+    # Groups with at most this many unsettled users get an exact minimum-transfer plan
+    _EXACT_SETTLEMENT_LIMIT = 15
+    
+    # Groups with at least this many unsettled users use the compiled greedy when numba is installed
+    _COMPILED_SETTLEMENT_THRESHOLD = 1000
     
     def __init__(self):
         # Dictionary to store user objects with user_id as key
@@ -150,18 +568,42 @@ class ExpenseManager:
         # Maps user_id to a set of transaction_ids involving that user
         self.user_transactions: Dict[str, Set[str]] = {}
         
-        # Cache for user balances - will be invalidated when transactions change
-        self._balance_cache: Dict[str, Dict[str, Decimal]] = {}
-        self._cache_valid = False
+        # Running balances in cents, updated as transactions are added or removed
+        # _net_positions maps user_id to paid - owed across all transactions
+        # _debts holds who owes whom, with circular debts cancelled as they appear
+        self._net_positions: Dict[str, int] = {}
+        self._debts = DebtGraph()
+        
+        # Derived views are cached against _version, which is bumped whenever users or balances change
+        self._version = 0
+        self._view_cache: Dict[str, Tuple[int, object]] = {}
+        
+        # Current suggested transfers in cents, keyed by (debtor, creditor). Rebuilt
+        # only when expenses change; recorded payments pay down their matching entry
+        self._settlement_plan: Optional[Dict[Tuple[str, str], int]] = None
+        
+        # IDs come from a per-process counter instead of uuid4, which reads os.urandom
+        # on every call. The pid and start time keep them unique across saved sessions
+        self._id_session = f"{os.getpid():x}{time.time_ns():x}"
+        self._id_counter = itertools.count()
+    
+    def _new_id(self, prefix: str) -> str:
+        return f"{prefix}_{self._id_session}_{next(self._id_counter):x}"
+    
+    def _cached(self, key: str, compute):
+
+        entry = self._view_cache.get(key)
+        if entry is None or entry[0] != self._version:
+            entry = (self._version, compute())
+            self._view_cache[key] = entry
+        return entry[1]
     
     def add_user(self, name: str, email: str) -> User:
-        user_id = str(uuid.uuid4())
+        user_id = self._new_id("user")
         user = User(user_id, name, email)
         self.users[user_id] = user
         self.user_transactions[user_id] = set()
-        
-        # Invalidate balance cache when users change
-        self._cache_valid = False
+        self._version += 1
         
         return user
     
@@ -179,12 +621,27 @@ class ExpenseManager:
                        split_type: SplitType = SplitType.EQUAL,
                        split_details: Optional[Dict[str, Decimal]] = None) -> Transaction:
 
+        transaction = self._store_transaction(description, payers, participants, split_type, split_details)
+        
+        # New expenses change who should pay whom, so the plan is rebuilt on next request
+        self._settlement_plan = None
+        
+        return transaction
+    
+    def _store_transaction(self,
+                           description: str,
+                           payers: Dict[str, Decimal],
+                           participants: List[str],
+                           split_type: SplitType = SplitType.EQUAL,
+                           split_details: Optional[Dict[str, Decimal]] = None) -> Transaction:
+
         # Validate that all users exist
-        for user_id in list(payers.keys()) + participants:
-            if user_id not in self.users:
-                raise ValueError(f"User {user_id} does not exist")
+        affected = set(payers).union(participants)
+        missing = affected.difference(self.users)
+        if missing:
+            raise ValueError(f"Users do not exist: {', '.join(sorted(missing))}")
         
-        transaction_id = str(uuid.uuid4())
+        transaction_id = self._new_id("txn")
         transaction = Transaction(
             transaction_id=transaction_id,
             description=description,
@@ -198,17 +655,56 @@ class ExpenseManager:
         self.transactions[transaction_id] = transaction
         
         # Update user_transactions index
-        for user_id in set(payers.keys()).union(set(participants)):
+        for user_id in affected:
             if user_id in self.user_transactions:
                 self.user_transactions[user_id].add(transaction_id)
             else:
                 self.user_transactions[user_id] = {transaction_id}
         
-        # Invalidate balance cache
-        self._cache_valid = False
+        # Fold the new transaction into the running balances
+        self._apply_transaction(transaction)
                 
         return transaction
     
+    def remove_transaction(self, transaction_id: str) -> Transaction:
+
+        transaction = self.transactions.pop(transaction_id, None)
+        if transaction is None:
+            raise ValueError(f"Transaction {transaction_id} does not exist")
+        
+        # Update user_transactions index
+        for user_id in transaction._payers_set | transaction._participants_set:
+            self.user_transactions.get(user_id, set()).discard(transaction_id)
+        
+        # Reverse the transaction's effect on the running balances
+        self._apply_transaction(transaction, sign=-1)
+        self._settlement_plan = None
+        
+        return transaction
+    
+    def record_payment(self, debtor_id: str, creditor_id: str, amount: Decimal) -> Transaction:
+
+        if debtor_id == creditor_id:
+            raise ValueError("A user cannot pay themselves")
+        
+        # A payment is stored as a transaction paid by the debtor and owed entirely
+        # by the creditor, which moves both net positions by the amount
+        payment = self._store_transaction("Payment", {debtor_id: amount}, [creditor_id])
+        
+        # Keep the plan stable: pay down the matching suggestion instead of replanning.
+        # A payment that does not follow the plan forces a rebuild on next request
+        if self._settlement_plan is not None:
+            key = (debtor_id, creditor_id)
+            planned = self._settlement_plan.get(key, 0)
+            if payment.total_cents < planned:
+                self._settlement_plan[key] = planned - payment.total_cents
+            elif payment.total_cents == planned:
+                del self._settlement_plan[key]
+            else:
+                self._settlement_plan = None
+        
+        return payment
+    
     def get_transaction(self, transaction_id: str) -> Optional[Transaction]:
         return self.transactions.get(transaction_id)
     
@@ -220,120 +716,185 @@ class ExpenseManager:
         transaction_ids = self.user_transactions[user_id]
         return [self.transactions[tid] for tid in transaction_ids if tid in self.transactions]
     
-    def _calculate_balances(self) -> Dict[str, Dict[str, Decimal]]:
+    def _apply_transaction(self, transaction: Transaction, sign: int = 1):
+
+        # Transactions contribute independently, so balances can be updated
+        # by adding (sign=1) or subtracting (sign=-1) a single transaction
+        self._version += 1
+        self._apply_net_positions(transaction, sign)
+        self._apply_debts(transaction, sign)
+    
+    def _apply_net_positions(self, transaction: Transaction, sign: int = 1):
+
+        # Entries that reach zero are dropped so only active users are stored
+        for user_id, delta in transaction.net_contributions.items():
+            position = self._net_positions.get(user_id, 0) + sign * delta
+            if position:
+                self._net_positions[user_id] = position
+            else:
+                self._net_positions.pop(user_id, None)
+    
+    def _apply_debts(self, transaction: Transaction, sign: int = 1):
 
-        # Initialize balances matrix
-        balances = {user_id: {other_id: Decimal('0') for other_id in self.users if other_id != user_id} 
-                   for user_id in self.users}
-        
-        # Process all transactions
-        for transaction in self.transactions.values():
-            for user_id in self.users:
-                user_balance = transaction.get_user_balance(user_id)
-                if user_balance != 0:
-                    # This user has a non-zero balance in this transaction
-                    # If positive, they are owed money; if negative, they owe money
-                    for other_id in self.users:
-                        if other_id != user_id:
-                            other_balance = transaction.get_user_balance(other_id)
-                            if other_balance < 0 and user_balance > 0:
-                                # Other user owes money, and this user is owed money
-                                # Calculate how much of other's debt should be paid to this user
-                                total_positive = sum(
-                                    max(transaction.get_user_balance(uid), 0) 
-                                    for uid in transaction.participants 
-                                    if uid != other_id
-                                )
-                                if total_positive > 0:
-                                    # This user's share of the other's debt
-                                    share = (user_balance / total_positive) * abs(other_balance)
-                                    balances[other_id][user_id] += share
-        
-        return balances
+        # Users with a positive net position are owed money in this transaction
+        net = transaction.net_contributions
+        creditors = [(user_id, cents) for user_id, cents in net.items() if cents > 0]
+        debtors = [(user_id, -cents) for user_id, cents in net.items() if cents < 0]
+        
+        # Each debtor's debt is split across creditors in proportion to what they are owed.
+        # Removing a transaction records the same debts in the opposite direction
+        matrix = _allocate_debts([debt for _, debt in debtors], [credit for _, credit in creditors])
+        for (debtor_id, _), shares in zip(debtors, matrix):
+            for (creditor_id, _), share in zip(creditors, shares):
+                if not share:
+                    continue
+                if sign > 0:
+                    self._debts.add(debtor_id, creditor_id, share)
+                else:
+                    self._debts.add(creditor_id, debtor_id, share)
     
     def get_balances(self) -> Dict[str, Dict[str, Decimal]]:
-        if not self._cache_valid:
-            self._balance_cache = self._calculate_balances()
-            self._cache_valid = True
-            
-        return self._balance_cache
+
+        return self._cached("balances", self._calculate_balances)
+    
+    def _calculate_balances(self) -> Dict[str, Dict[str, Decimal]]:
+
+        empty: Dict[str, int] = {}
+        return {user_id: {creditor_id: _from_cents(cents)
+                          for creditor_id, cents in self._debts.owes.get(user_id, empty).items()}
+                for user_id in self.users}
     
     def get_user_balance(self, user_id: str) -> Dict[str, Decimal]:
 
         if user_id not in self.users:
             raise ValueError(f"User {user_id} does not exist")
             
-        balances = self.get_balances()
-        
-        # Calculate what this user owes to others
-        owes = {other_id: amount for other_id, amount in balances[user_id].items() if amount > 0}
-        
-        # Calculate what others owe to this user
-        owed = {other_id: amount for other_id, amount in 
-                {o_id: balances[o_id].get(user_id, Decimal('0')) for o_id in self.users if o_id != user_id}.items() 
-                if amount > 0}
+        # Only this user's counterparties are visited, not every user
+        empty: Dict[str, int] = {}
+        user_owes = self._debts.owes.get(user_id, empty)
+        user_owed = self._debts.owed_by.get(user_id, empty)
         
         # Calculate net balance
         net = {}
-        for other_id in self.users:
-            if other_id != user_id:
-                owed_amount = owed.get(other_id, Decimal('0'))
-                owes_amount = owes.get(other_id, Decimal('0'))
-                if owed_amount > owes_amount:
-                    net[other_id] = owed_amount - owes_amount  # Positive: other owes user
-                elif owes_amount > owed_amount:
-                    net[other_id] = -(owes_amount - owed_amount)  # Negative: user owes other
+        for other_id in {**user_owed, **user_owes}:
+            amount = user_owed.get(other_id, 0) - user_owes.get(other_id, 0)
+            if amount:
+                net[other_id] = _from_cents(amount)  # Positive: other owes user; negative: user owes other
         
         return net
     
     def get_simplified_settlements(self) -> List[Tuple[str, str, Decimal]]:
 
-        # Create a list of all net balances
-        balances = []
-        for user_id in self.users:
-            net_balance = sum(
-                transaction.get_user_balance(user_id) 
-                for transaction in self.transactions.values()
-                if user_id in transaction.participants or user_id in transaction.payers
-            )
-            balances.append((user_id, net_balance))
+        if self._settlement_plan is None:
+            self._settlement_plan = {}
+            for debtor, creditor, amount in self._calculate_settlements():
+                key = (debtor, creditor)
+                self._settlement_plan[key] = self._settlement_plan.get(key, 0) + amount
         
-        # Sort by balance (ascending)
-        balances.sort(key=lambda x: x[1])
+        return [(debtor, creditor, _from_cents(amount))
+                for (debtor, creditor), amount in self._settlement_plan.items()]
+    
+    def _calculate_settlements(self) -> List[Tuple[str, str, int]]:
+
+        # Net balances in cents come straight from the running totals, which only hold nonzero entries
+        balances = list(self._net_positions.items())
+        
+        # Small groups get the minimum number of transfers; larger ones fall back to the greedy
+        if len(balances) <= self._EXACT_SETTLEMENT_LIMIT:
+            return self._exact_settlements(balances)
+        if njit is not None and len(balances) >= self._COMPILED_SETTLEMENT_THRESHOLD:
+            return self._compiled_settlements(balances)
+        return self._greedy_settlements(balances)
+    
+    def _compiled_settlements(self, balances: List[Tuple[str, int]]) -> List[Tuple[str, str, int]]:
+
+        # Sort int64 cents in C, run the greedy loop natively, then map indices back to user ids
+        user_ids = [user_id for user_id, _ in balances]
+        amounts = np.fromiter((net for _, net in balances), dtype=np.int64, count=len(balances))
+        order = np.argsort(amounts, kind="stable")
+        debtors, creditors, transfers = _settle_sorted(amounts[order])
+        order = order.tolist()
+        return [(user_ids[order[i]], user_ids[order[j]], amount)
+                for i, j, amount in zip(debtors.tolist(), creditors.tolist(), transfers.tolist())]
+    
+    def _greedy_settlements(self, balances: List[Tuple[str, int]]) -> List[Tuple[str, str, int]]:
+
+        # debtors is a min-heap of negative balances; creditors is a max-heap via negation
+        debtors = [(net, user_id) for user_id, net in balances if net < 0]
+        creditors = [(-net, user_id) for user_id, net in balances if net > 0]
+        heapq.heapify(debtors)
+        heapq.heapify(creditors)
         
         settlements = []
         
-        # While there are unprocessed balances
-        i, j = 0, len(balances) - 1
-        while i < j:
-            # Get users with most negative and most positive balances
-            debtor, debt = balances[i]
-            creditor, credit = balances[j]
-            
-            if abs(debt) < Decimal('0.01') and abs(credit) < Decimal('0.01'):
-                # Both balances are effectively zero
-                i += 1
-                j -= 1
-                continue
-                
-            if debt >= 0 or credit <= 0:
-                # No more meaningful settlements to make
-                break
-                
-            # Calculate settlement amount
-            amount = min(abs(debt), credit)
-            if amount > Decimal('0.01'):  # Only create settlement if amount is significant
-                settlements.append((debtor, creditor, amount))
+        # Repeatedly settle the largest debtor against the largest creditor
+        while debtors and creditors:
+            debt, debtor = heapq.heappop(debtors)
+            negated_credit, creditor = heapq.heappop(creditors)
+            credit = -negated_credit
             
-            # Update balances
-            balances[i] = (debtor, debt + amount)
-            balances[j] = (creditor, credit - amount)
+            amount = min(-debt, credit)
+            settlements.append((debtor, creditor, amount))
             
-            # Move pointers if balances are settled
-            if abs(balances[i][1]) < Decimal('0.01'):
-                i += 1
-            if abs(balances[j][1]) < Decimal('0.01'):
-                j -= 1
+            # Re-push whatever is left over; amounts are exact cents so no tolerance is needed
+            if debt + amount < 0:
+                heapq.heappush(debtors, (debt + amount, debtor))
+            if credit - amount > 0:
+                heapq.heappush(creditors, (amount - credit, creditor))
+        
+        return settlements
+    
+    def _exact_settlements(self, balances: List[Tuple[str, int]]) -> List[Tuple[str, str, int]]:
+
+        # The fewest transfers is n - k, where k is the largest number of disjoint
+        # zero-sum groups the balances can be partitioned into; each group of size m
+        # then settles internally with m - 1 transfers.
+        # dp[mask] is the most zero-sum groups obtainable from the users in mask.
+        n = len(balances)
+        full = (1 << n) - 1
+        sums = [0] * (full + 1)
+        dp = [0] * (full + 1)
+        for mask in range(1, full + 1):
+            low = mask & -mask
+            sums[mask] = sums[mask ^ low] + balances[low.bit_length() - 1][1]
+            best = 0
+            rest = mask
+            while rest:
+                bit = rest & -rest
+                if dp[mask ^ bit] > best:
+                    best = dp[mask ^ bit]
+                rest ^= bit
+            dp[mask] = best + (1 if sums[mask] == 0 else 0)
+        
+        # Walk back from the full set to recover an order in which users were added
+        order = []
+        mask = full
+        while mask:
+            target = dp[mask] - (1 if sums[mask] == 0 else 0)
+            rest = mask
+            while rest:
+                bit = rest & -rest
+                if dp[mask ^ bit] == target:
+                    break
+                rest ^= bit
+            order.append(bit.bit_length() - 1)
+            mask ^= bit
+        order.reverse()
+        
+        # Every zero prefix sum along that order closes a zero-sum group
+        settlements = []
+        group: List[Tuple[str, int]] = []
+        running = 0
+        for i in order:
+            group.append(balances[i])
+            running += balances[i][1]
+            if running == 0:
+                settlements.extend(self._greedy_settlements(group))
+                group = []
+        
+        # Balances that do not sum to zero leave a trailing group; settle what can be settled
+        if group:
+            settlements.extend(self._greedy_settlements(group))
         
         return settlements
     
@@ -342,17 +903,23 @@ class ExpenseManager:
         data = {
             "users": {uid: user.to_dict() for uid, user in self.users.items()},
             "transactions": {tid: transaction.to_dict() for tid, transaction in self.transactions.items()},
-            "user_transactions": {uid: list(tids) for uid, tids in self.user_transactions.items()}
+            "user_transactions": {uid: list(tids) for uid, tids in self.user_transactions.items()},
+            "debts_cents": self._debts.to_dict()
         }
         
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=2)
+        if orjson is not None:
+            with open(filename, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(filename, 'w') as f:
+                json.dump(data, f, indent=2)
     
     @classmethod
     def load_from_file(cls, filename: str) -> 'ExpenseManager':
 
-        with open(filename, 'r') as f:
-            data = json.load(f)
+        with open(filename, 'rb') as f:
+            raw = f.read()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
         
         manager = cls()
         
@@ -370,6 +937,18 @@ class ExpenseManager:
         for uid, tids in data["user_transactions"].items():
             manager.user_transactions[uid] = set(tids)
         
+        # Rebuild running balances. Which circular debts were cancelled depends on the
+        # order transactions were added and removed in, which the file does not record,
+        # so the saved pairwise debts are reused when they agree with the transactions
+        for transaction in manager.transactions.values():
+            manager._apply_net_positions(transaction)
+        debts = DebtGraph.from_dict(data["debts_cents"]) if "debts_cents" in data else None
+        if debts is not None and debts.net_positions() == manager._net_positions:
+            manager._debts = debts
+        else:
+            for transaction in manager.transactions.values():
+                manager._apply_debts(transaction)
+        
         return manager
 
 
@@ -385,9 +964,11 @@ class ExpenseCLI:
             "get_user": self.get_user,
             "add_transaction": self.add_transaction,
             "get_transaction": self.get_transaction,
+            "remove_transaction": self.remove_transaction,
             "get_user_transactions": self.get_user_transactions,
             "get_user_balance": self.get_user_balance,
             "get_settlements": self.get_settlements,
+            "record_payment": self.record_payment,
             "save": self.save,
             "load": self.load,
             "exit": self.exit
@@ -505,6 +1086,15 @@ class ExpenseCLI:
         else:
             print(f"Transaction with ID {transaction_id} not found.")
     
+    def remove_transaction(self):
+
+        transaction_id = input("Enter transaction ID: ")
+        try:
+            transaction = self.expense_manager.remove_transaction(transaction_id)
+            print(f"Transaction {transaction.transaction_id} removed.")
+        except Exception as e:
+            print(f"Error removing transaction: {str(e)}")
+    
     def get_user_transactions(self):
 
         user_id = input("Enter user ID: ")
@@ -554,6 +1144,17 @@ class ExpenseCLI:
             to_user = self.expense_manager.get_user(to_id)
             print(f"  {from_user.name} ({from_id}) pays {to_user.name} ({to_id}): {amount}")
     
+    def record_payment(self):
+
+        debtor_id = input("Enter paying user ID: ")
+        creditor_id = input("Enter receiving user ID: ")
+        amount = input("Enter amount paid: ")
+        try:
+            payment = self.expense_manager.record_payment(debtor_id, creditor_id, Decimal(amount))
+            print(f"Payment recorded with ID: {payment.transaction_id}")
+        except Exception as e:
+            print(f"Error recording payment: {str(e)}")
+    
     def save(self):
 
         filename = input("Enter filename: ")
@@ -0,0 +1,424 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+import main
+from main import DebtGraph, ExpenseManager, SplitType, Transaction
+
+
+def random_manager(rng: random.Random, max_users: int = 12, max_transactions: int = 25) -> ExpenseManager:
+    # A manager with a random mix of equal, percentage and exact splits, some later removed
+    manager = ExpenseManager()
+    users = [manager.add_user(f"user{i}", f"user{i}@example.com").user_id
+             for i in range(rng.randint(2, max_users))]
+    added = []
+    for _ in range(rng.randint(1, max_transactions)):
+        participants = rng.sample(users, rng.randint(1, len(users)))
+        payers = {user_id: Decimal(rng.randint(1, 99999)) / 100
+                  for user_id in rng.sample(users, rng.randint(1, min(3, len(users))))}
+        total = sum(payers.values()) * 100
+        split_type = rng.choice(list(SplitType))
+        split_details = None
+        if split_type == SplitType.PERCENTAGE:
+            cuts = sorted(rng.randint(0, 10000) for _ in range(len(participants) - 1))
+            bounds = [0] + cuts + [10000]
+            split_details = {user_id: Decimal(bounds[i + 1] - bounds[i]) / 100
+                             for i, user_id in enumerate(participants)}
+        elif split_type == SplitType.EXACT:
+            cuts = sorted(rng.randint(0, int(total)) for _ in range(len(participants) - 1))
+            bounds = [0] + cuts + [int(total)]
+            split_details = {user_id: Decimal(bounds[i + 1] - bounds[i]) / 100
+                             for i, user_id in enumerate(participants)}
+        added.append(manager.add_transaction("expense", payers, participants, split_type, split_details))
+    for transaction in rng.sample(added, rng.randint(0, len(added) // 3)):
+        manager.remove_transaction(transaction.transaction_id)
+    return manager
+
+
+def rescan_net_positions(manager: ExpenseManager) -> dict:
+    net = {}
+    for transaction in manager.transactions.values():
+        for user_id, cents in transaction.net_contributions.items():
+            net[user_id] = net.get(user_id, 0) + cents
+    return {user_id: cents for user_id, cents in net.items() if cents}
+
+
+def apply_settlements(balances: dict, settlements) -> dict:
+    remaining = dict(balances)
+    for debtor, creditor, amount in settlements:
+        remaining[debtor] = remaining.get(debtor, 0) + amount
+        remaining[creditor] = remaining.get(creditor, 0) - amount
+    return remaining
+
+
+class BalanceInvariantTests(unittest.TestCase):
+
+    def test_net_positions_match_full_rescan(self):
+        rng = random.Random(4)
+        for _ in range(100):
+            manager = random_manager(rng)
+            self.assertEqual(manager._net_positions, rescan_net_positions(manager))
+            self.assertEqual(sum(manager._net_positions.values()), 0)
+
+    def test_pairwise_balances_match_net_positions(self):
+        rng = random.Random(15)
+        for _ in range(100):
+            manager = random_manager(rng)
+            for user_id in manager.users:
+                pairwise = sum(manager.get_user_balance(user_id).values(), Decimal("0"))
+                self.assertEqual(pairwise * 100, manager._net_positions.get(user_id, 0))
+
+    def test_settlements_zero_out_all_balances(self):
+        rng = random.Random(6)
+        for _ in range(100):
+            manager = random_manager(rng)
+            settlements = [(debtor, creditor, int(amount * 100))
+                           for debtor, creditor, amount in manager.get_simplified_settlements()]
+            self.assertTrue(all(amount > 0 for _, _, amount in settlements))
+            remaining = apply_settlements(manager._net_positions, settlements)
+            self.assertTrue(all(cents == 0 for cents in remaining.values()))
+            self.assertLessEqual(len(settlements), max(0, len(manager._net_positions) - 1))
+
+
+class ExactSettlementTests(unittest.TestCase):
+
+    def test_never_uses_more_transfers_than_greedy(self):
+        rng = random.Random(7)
+        manager = ExpenseManager()
+        for _ in range(300):
+            values = [rng.choice([-500, -300, -200, -100, 100, 200, 300, 500]) for _ in range(rng.randint(1, 9))]
+            values.append(-sum(values))
+            balances = [(f"u{i}", value) for i, value in enumerate(values) if value]
+            exact = manager._exact_settlements(balances)
+            greedy = manager._greedy_settlements(balances)
+            self.assertLessEqual(len(exact), len(greedy))
+            remaining = apply_settlements(dict(balances), exact)
+            self.assertTrue(all(cents == 0 for cents in remaining.values()))
+
+    def test_unbalanced_trailing_group_is_still_settled(self):
+        # Balances that do not sum to zero must not be silently dropped
+        manager = ExpenseManager()
+        settlements = manager._exact_settlements([("a", 500), ("b", -200)])
+        self.assertEqual(settlements, [("b", "a", 200)])
+
+    def test_zero_sum_groups_settle_with_fewest_transfers(self):
+        manager = ExpenseManager()
+        balances = [("a", -300), ("b", 300), ("c", -500), ("d", 200), ("e", 300)]
+        settlements = manager._exact_settlements(balances)
+        self.assertEqual(len(settlements), 3)
+        remaining = apply_settlements(dict(balances), settlements)
+        self.assertTrue(all(value == 0 for value in remaining.values()))
+
+
+class DuplicateParticipantTests(unittest.TestCase):
+
+    def test_percentage_split_counts_repeated_participant_once(self):
+        transaction = Transaction("t1", "lunch", datetime(2024, 1, 1), {"a": Decimal("1.00")},
+                                  ["a", "a", "b"], SplitType.PERCENTAGE, {"a": Decimal(50), "b": Decimal(50)})
+        self.assertEqual(transaction.net_contributions, {"a": 50, "b": -50})
+
+    def test_exact_split_counts_repeated_participant_once(self):
+        transaction = Transaction("t1", "lunch", datetime(2024, 1, 1), {"a": Decimal("1.00")},
+                                  ["a", "b", "b"], SplitType.EXACT, {"a": Decimal("0.40"), "b": Decimal("0.60")})
+        self.assertEqual(transaction.net_contributions, {"a": 60, "b": -60})
+
+    def test_manager_balances_stay_zero_sum(self):
+        manager = ExpenseManager()
+        a = manager.add_user("A", "a@example.com").user_id
+        b = manager.add_user("B", "b@example.com").user_id
+        manager.add_transaction("lunch", {a: Decimal("1.00")}, [a, a, b],
+                                SplitType.PERCENTAGE, {a: Decimal(50), b: Decimal(50)})
+        self.assertEqual(manager._net_positions, {a: 50, b: -50})
+        self.assertEqual(manager.get_simplified_settlements(), [(b, a, Decimal("0.50"))])
+
+
+class TransactionSerializationTests(unittest.TestCase):
+
+    def make_transaction(self):
+        return Transaction("t1", "dinner", datetime(2024, 1, 2, 3, 4, 5),
+                           {"a": Decimal("10.00"), "b": Decimal("5.01")}, ["a", "b", "c"],
+                           SplitType.EXACT, {"a": Decimal("5.00"), "b": Decimal("5.00"), "c": Decimal("5.01")})
+
+    def test_v2_round_trip(self):
+        transaction = self.make_transaction()
+        data = transaction.to_dict()
+        self.assertEqual(data["v"], 2)
+        self.assertEqual(data["payers_cents"], {"a": 1000, "b": 501})
+        loaded = Transaction.from_dict(data)
+        self.assertEqual(loaded.to_dict(), data)
+        self.assertEqual(loaded.net_contributions, transaction.net_contributions)
+
+    def test_v1_records_still_load(self):
+        data = {
+            "transaction_id": "t1",
+            "description": "dinner",
+            "date": "2024-01-02T03:04:05",
+            "payers": {"a": "30.00"},
+            "participants": ["a", "b", "c"],
+            "split_type": "percentage",
+            "split_details": {"a": "50", "b": "25", "c": "25"},
+            "total_amount": "30.00"
+        }
+        transaction = Transaction.from_dict(data)
+        self.assertEqual(transaction.net_contributions, {"a": 1500, "b": -750, "c": -750})
+
+    @staticmethod
+    def v1_record(payers, participants, split_type, split_details):
+        return {
+            "transaction_id": "t1",
+            "description": "dinner",
+            "date": "2024-01-02T03:04:05",
+            "payers": payers,
+            "participants": participants,
+            "split_type": split_type,
+            "split_details": split_details,
+            "total_amount": str(sum(Decimal(amount) for amount in payers.values()))
+        }
+
+    def test_v1_percentages_within_tolerance_are_normalised(self):
+        data = self.v1_record({"a": "30.00"}, ["a", "b", "c"], "percentage",
+                              {"a": "33.33", "b": "33.33", "c": "33.33"})
+        transaction = Transaction.from_dict(data)
+        self.assertEqual(transaction.split_details,
+                         {"a": Decimal("33.34"), "b": Decimal("33.33"), "c": Decimal("33.33")})
+        self.assertEqual(sum(transaction.net_contributions.values()), 0)
+
+    def test_v1_sub_cent_payment_is_rounded(self):
+        transaction = Transaction.from_dict(self.v1_record({"a": "10.005"}, ["a", "b"], "equal", {}))
+        self.assertEqual(transaction.total_cents, 1001)
+        self.assertEqual(transaction.net_contributions, {"a": 500, "b": -500})
+
+    def test_v1_exact_split_off_by_a_cent_is_normalised(self):
+        data = self.v1_record({"a": "10.00"}, ["a", "b"], "exact", {"a": "5.00", "b": "5.01", "z": "0"})
+        transaction = Transaction.from_dict(data)
+        self.assertEqual(transaction.split_details, {"a": Decimal("4.99"), "b": Decimal("5.01")})
+        self.assertEqual(transaction.net_contributions, {"a": 501, "b": -501})
+
+    def test_v1_split_without_details_loads_as_equal(self):
+        transaction = Transaction.from_dict(self.v1_record({"a": "9.00"}, ["a", "b", "c"], "percentage", {}))
+        self.assertEqual(transaction.split_type, SplitType.EQUAL)
+        self.assertEqual(transaction.net_contributions, {"a": 600, "b": -300, "c": -300})
+
+    def test_invalid_record_error_names_the_transaction(self):
+        with self.assertRaisesRegex(ValueError, "Transaction t1: "):
+            Transaction.from_dict(self.v1_record({"a": "-1.00"}, ["a"], "equal", {}))
+
+    def test_v2_rejects_non_integer_cents(self):
+        for field, value in [("payers_cents", {"a": "1000"}), ("payers_cents", {"a": 10.5}),
+                             ("payers_cents", {"a": True}), ("split_details_cents", {"a": 1000.0})]:
+            data = self.make_transaction().to_dict()
+            data.update(split_type="exact", payers_cents={"a": 1000}, split_details_cents={"a": 1000})
+            data[field] = value
+            with self.assertRaisesRegex(ValueError, "Transaction t1: .*integer cents"):
+                Transaction.from_dict(data)
+
+    def test_to_dict_does_not_expose_internal_state(self):
+        transaction = self.make_transaction()
+        data = transaction.to_dict()
+        data["payers_cents"]["a"] = 1
+        data["split_details_cents"]["c"] = 1
+        data["participants"].append("z")
+        self.assertEqual(transaction.total_amount, Decimal("15.01"))
+        self.assertEqual(transaction.to_dict(), self.make_transaction().to_dict())
+
+
+@unittest.skipIf(main.njit is None, "numba and numpy are not installed")
+class CompiledSettlementTests(unittest.TestCase):
+
+    def test_compiled_settles_like_greedy(self):
+        rng = random.Random(12)
+        manager = ExpenseManager()
+        for _ in range(20):
+            values = [rng.randint(-10 ** 6, 10 ** 6) for _ in range(rng.randint(20, 300))]
+            values.append(-sum(values))
+            balances = [(f"u{i}", value) for i, value in enumerate(values) if value]
+            compiled = manager._compiled_settlements(balances)
+            greedy = manager._greedy_settlements(balances)
+            for settlements in (compiled, greedy):
+                remaining = apply_settlements(dict(balances), settlements)
+                self.assertTrue(all(cents == 0 for cents in remaining.values()))
+                self.assertTrue(all(amount > 0 for _, _, amount in settlements))
+            self.assertTrue(all(isinstance(amount, int) for _, _, amount in compiled))
+            self.assertLessEqual(len(compiled), len(balances) - 1)
+
+
+class CycleCancellationTests(unittest.TestCase):
+
+    @staticmethod
+    def net_of(graph: dict) -> dict:
+        net = {}
+        for debtor_id, row in graph.items():
+            for creditor_id, cents in row.items():
+                net[debtor_id] = net.get(debtor_id, 0) - cents
+                net[creditor_id] = net.get(creditor_id, 0) + cents
+        return {user_id: cents for user_id, cents in net.items() if cents}
+
+    def assert_valid_graph(self, graph: DebtGraph):
+        # Every debt runs forward in the order, which also rules out cycles
+        for debtor_id, row in graph.owes.items():
+            for creditor_id, cents in row.items():
+                self.assertGreater(cents, 0)
+                self.assertLess(graph.order[debtor_id], graph.order[creditor_id])
+        mirrored = {}
+        for debtor_id, row in graph.owes.items():
+            for creditor_id, cents in row.items():
+                mirrored.setdefault(creditor_id, {})[debtor_id] = cents
+        self.assertEqual(graph.owed_by, mirrored)
+        self.assertEqual(len(set(graph.order.values())), len(graph.order))
+
+    def test_adding_debts_preserves_net_positions_and_removes_cycles(self):
+        rng = random.Random(8)
+        for _ in range(300):
+            n = rng.randint(2, 9)
+            graph, expected = DebtGraph(), {}
+            for _ in range(rng.randint(0, n * n)):
+                debtor, creditor = (str(i) for i in rng.sample(range(n), 2))
+                cents = rng.randint(1, 50)
+                graph.add(debtor, creditor, cents)
+                expected.setdefault(debtor, {})[creditor] = expected.get(debtor, {}).get(creditor, 0) + cents
+                self.assert_valid_graph(graph)
+            self.assertEqual(graph.net_positions(), self.net_of(expected))
+
+    def test_three_way_cycle_cancels_to_remainder(self):
+        graph = DebtGraph()
+        graph.add("a", "b", 500)
+        graph.add("b", "c", 300)
+        graph.add("c", "a", 300)
+        self.assertEqual(graph.owes, {"a": {"b": 200}})
+        self.assertEqual(graph.owed_by, {"b": {"a": 200}})
+
+    def test_manager_graph_stays_acyclic_as_transactions_change(self):
+        rng = random.Random(9)
+        for _ in range(100):
+            manager = random_manager(rng)
+            self.assert_valid_graph(manager._debts)
+            self.assertEqual(manager._debts.net_positions(), manager._net_positions)
+
+    def test_from_dict_rejects_circular_or_malformed_debts(self):
+        self.assertIsNone(DebtGraph.from_dict({"a": {"b": 1}, "b": {"c": 1}, "c": {"a": 1}}))
+        self.assertIsNone(DebtGraph.from_dict({"a": {"b": 1}, "b": {"a": 2}}))
+        self.assertIsNone(DebtGraph.from_dict({"a": {"b": "1"}}))
+        self.assertIsNone(DebtGraph.from_dict({"a": {"a": 1}}))
+        graph = DebtGraph.from_dict({"a": {"b": 1, "c": 2}, "b": {"c": 3}})
+        self.assert_valid_graph(graph)
+        self.assertEqual(graph.to_dict(), {"a": {"b": 1, "c": 2}, "b": {"c": 3}})
+
+
+class RecordPaymentTests(unittest.TestCase):
+
+    def test_matching_payments_keep_the_rest_of_the_plan(self):
+        rng = random.Random(18)
+        for _ in range(100):
+            manager = random_manager(rng, max_users=20, max_transactions=10)
+            plan = manager.get_simplified_settlements()
+            if not plan:
+                continue
+            debtor, creditor, amount = plan[0]
+            part = (amount / 2).quantize(Decimal("0.01"))
+            if part > 0:
+                manager.record_payment(debtor, creditor, part)
+                expected = ([(debtor, creditor, amount - part)] if amount - part else []) + plan[1:]
+                plan = manager.get_simplified_settlements()
+                self.assertEqual(plan, expected)
+            for debtor, creditor, amount in list(plan):
+                manager.record_payment(debtor, creditor, amount)
+                self.assertEqual(manager.get_simplified_settlements(), plan[plan.index((debtor, creditor, amount)) + 1:])
+            self.assertEqual(manager._net_positions, {})
+
+    def test_off_plan_payment_rebuilds_the_plan(self):
+        manager = ExpenseManager()
+        a = manager.add_user("A", "a@example.com").user_id
+        b = manager.add_user("B", "b@example.com").user_id
+        manager.add_transaction("dinner", {a: Decimal("10.00")}, [a, b])
+        self.assertEqual(manager.get_simplified_settlements(), [(b, a, Decimal("5.00"))])
+        manager.record_payment(a, b, Decimal("1.00"))
+        self.assertEqual(manager.get_simplified_settlements(), [(b, a, Decimal("6.00"))])
+
+    def test_payment_to_self_is_rejected(self):
+        manager = ExpenseManager()
+        a = manager.add_user("A", "a@example.com").user_id
+        with self.assertRaises(ValueError):
+            manager.record_payment(a, a, Decimal("1.00"))
+
+
+class PersistenceTests(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(suffix=".json")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_v2_file_round_trip(self):
+        rng = random.Random(20)
+        for _ in range(20):
+            manager = random_manager(rng)
+            manager.save_to_file(self.filename)
+            loaded = ExpenseManager.load_from_file(self.filename)
+            self.assertEqual(loaded._net_positions, manager._net_positions)
+            self.assertEqual(loaded.get_balances(), manager.get_balances())
+            self.assertEqual({tid: t.to_dict() for tid, t in loaded.transactions.items()},
+                             {tid: t.to_dict() for tid, t in manager.transactions.items()})
+
+    def test_largest_amount_saves_and_loads(self):
+        manager = ExpenseManager()
+        a = manager.add_user("A", "a@example.com").user_id
+        b = manager.add_user("B", "b@example.com").user_id
+        largest = main._from_cents(main._MAX_TOTAL_CENTS)
+        manager.add_transaction("house", {a: largest}, [a, b])
+        with self.assertRaises(ValueError):
+            manager.add_transaction("planet", {a: largest, b: Decimal("0.01")}, [a, b])
+        manager.save_to_file(self.filename)
+        loaded = ExpenseManager.load_from_file(self.filename)
+        self.assertEqual(loaded._net_positions, manager._net_positions)
+
+    def test_saved_debts_that_disagree_with_transactions_are_rebuilt(self):
+        rng = random.Random(22)
+        for _ in range(20):
+            manager = random_manager(rng)
+            manager.save_to_file(self.filename)
+            with open(self.filename) as f:
+                data = json.load(f)
+            data["debts_cents"] = {"nobody": {"someone": 100}}
+            with open(self.filename, "w") as f:
+                json.dump(data, f)
+            loaded = ExpenseManager.load_from_file(self.filename)
+            self.assertEqual(loaded._debts.net_positions(), manager._net_positions)
+
+    def test_v1_file_loads(self):
+        data = {
+            "users": {
+                "a": {"user_id": "a", "name": "A", "email": "a@example.com"},
+                "b": {"user_id": "b", "name": "B", "email": "b@example.com"}
+            },
+            "transactions": {
+                "t1": {
+                    "transaction_id": "t1",
+                    "description": "dinner",
+                    "date": "2024-01-02T03:04:05",
+                    "payers": {"a": "12.50"},
+                    "participants": ["a", "b"],
+                    "split_type": "equal",
+                    "split_details": {},
+                    "total_amount": "12.50"
+                }
+            },
+            "user_transactions": {"a": ["t1"], "b": ["t1"]}
+        }
+        with open(self.filename, "w") as f:
+            json.dump(data, f)
+        manager = ExpenseManager.load_from_file(self.filename)
+        self.assertEqual(manager._net_positions, {"a": 625, "b": -625})
+        self.assertEqual(manager.get_user_balance("a"), {"b": Decimal("6.25")})
+        manager.save_to_file(self.filename)
+        reloaded = ExpenseManager.load_from_file(self.filename)
+        self.assertEqual(reloaded._net_positions, manager._net_positions)
+
+
+if __name__ == "__main__":
+    unittest.main()